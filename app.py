@@ -1,17 +1,35 @@
-from flask import Flask, render_template, request, jsonify
-import uuid
+from flask import Flask, Response, render_template, request, session
+from flask_compress import Compress
+import secrets
+import threading
 import time
 import os
-import requests
 import json
+import logging
+import orjson
+from collections import OrderedDict
+from functools import lru_cache, wraps
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
+from requests_toolbelt.multipart.encoder import MultipartEncoder
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
 
 # Load environment variables from .env file
 load_dotenv()
 
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+log = logging.getLogger(__name__)
+
 # Import custom modules
-from auth import generate_jwt, generate_access_token as generate_token_with_jwt, validate_access_token
+from auth import (
+    generate_jwt,
+    generate_access_token as generate_token_with_jwt,
+    load_private_key_from_jwk,
+    get_access_token_expiry,
+    validate_access_token
+)
+from http_client import SF_SESSION, log_response
 from conversation_history import (
     generate_oauth_token as get_oauth_token,
     handle_send_conversation_history,
@@ -20,6 +38,21 @@ from conversation_history import (
 )
 
 app = Flask(__name__)
+# Signs the session cookie that maps a browser to its SessionState
+app.secret_key = os.getenv("FLASK_SECRET_KEY") or secrets.token_hex(32)
+
+# Largest file accepted by /api/send-file
+MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB in bytes
+
+# Werkzeug rejects larger request bodies before reading them.
+# The margin leaves room for the multipart boundaries and caption field.
+app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE + 64 * 1024
+
+# Compress JSON responses (conversation lists/entries are large and repetitive).
+# Brotli is preferred when the browser accepts it; tiny bodies are sent as-is.
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_MIN_SIZE'] = 512
+Compress(app)
 
 # Salesforce Configuration - Load from environment variables
 SCRT_URL = os.getenv("SCRT_URL")
@@ -28,20 +61,291 @@ ES_DEVELOPER_NAME = os.getenv("ES_DEVELOPER_NAME")
 KID = os.getenv("KID")
 JWK_PATH = os.getenv("JWK_PATH", "keys/infobip-private.json")
 
+# Parse the JWK once at startup; the key file does not change while the server runs.
+# If it is missing, token generation falls back to JWK_PATH and reports the error.
+try:
+    with open(JWK_PATH, 'r') as f:
+        _JWK = json.load(f)
+except (OSError, ValueError):
+    _JWK = None
+
+# Build the private key object from it once as well, so each token request only signs
+try:
+    _PRIVATE_KEY = load_private_key_from_jwk(JWK_PATH, jwk=_JWK) if _JWK is not None else None
+except Exception:
+    _PRIVATE_KEY = None
+
 # OAuth 2.0 Client Credentials (for Conversation History API)
 OAUTH_TOKEN_URL = os.getenv("OAUTH_TOKEN_URL")
 OAUTH_CLIENT_ID = os.getenv("OAUTH_CLIENT_ID")
 OAUTH_CLIENT_SECRET = os.getenv("OAUTH_CLIENT_SECRET")
 
+# Salesforce endpoint URLs, built once at import.
+# The *_T templates take the (lowercase) conversation ID: _URL_ENTRY_T({'cid': conversation_id})
+_IAMESSAGE_URL = f"{SCRT_URL}/iamessage/api/v2"
+_URL_UNAUTHENTICATED_TOKEN = f"{_IAMESSAGE_URL}/authorization/unauthenticated/access-token"
+_URL_CONVERSATION = f"{_IAMESSAGE_URL}/conversation"
+_URL_CONVERSATION_LIST = f"{_IAMESSAGE_URL}/conversation/list"
+_URL_ENTRY_T = f"{_IAMESSAGE_URL}/conversation/{{cid}}/entry".format_map
+_URL_MESSAGE_T = f"{_IAMESSAGE_URL}/conversation/{{cid}}/message".format_map
+_URL_FILE_T = f"{_IAMESSAGE_URL}/conversation/{{cid}}/file".format_map
+_URL_ENTRIES_T = f"{_IAMESSAGE_URL}/conversation/{{cid}}/entries".format_map
+_URL_CLOSE_T = f"{_IAMESSAGE_URL}/conversation/{{cid}}?esDeveloperName={ES_DEVELOPER_NAME}".format_map
+_URL_END_SESSION_T = f"{_IAMESSAGE_URL}/conversation/{{cid}}/session?esDeveloperName={ES_DEVELOPER_NAME}".format_map
+_URL_SSE = f"{SCRT_URL}/eventrouter/v1/sse"
 
-# In-memory storage for access token (untuk development)
-app_state = {
-    "access_token": None,
-    "last_event_id": None,
-    "conversation_id": None,
-    "channel_address_identifier": None
+
+# Valid typing indicator entry types, mapped to their success message
+_TYPING_INDICATOR_MESSAGES = {
+    entry_type: f"Typing indicator sent: {entry_type}"
+    for entry_type in ("TypingStartedIndicator", "TypingStoppedIndicator")
 }
 
+# Upper bound on how much of a failed Salesforce response is echoed back to the client
+MAX_ERROR_DETAIL_BYTES = 2048
+
+# Refresh JWT-authenticated tokens this many seconds before they actually expire
+TOKEN_EXPIRY_SKEW = 30
+
+DUMMY_CONVERSATION_PATH = 'dummy_im3_network_conversation.json'
+
+# Encoded /api/load-dummy-conversation response, rebuilt only when the file changes
+_dummy_conversation_cache = {"mtime": None, "body": None}
+
+
+@dataclass(slots=True)
+class SessionState:
+    """Simulator state for one browser session"""
+    access_token: str | None = None
+    access_token_exp: float | None = None  # time.monotonic() deadline, only set for JWT-authenticated tokens
+    auth_headers: dict | None = None  # Authorization header, rebuilt only when the token changes
+    last_event_id: str | None = None
+    conversation_id: str | None = None
+    channel_address_identifier: str | None = None
+    last_access: float = 0.0  # time.monotonic() of the last request that used this state
+
+
+# Browser sessions idle for longer than this are dropped from memory
+SESSION_IDLE_TIMEOUT = 2 * 60 * 60
+
+# Upper bound on stored browser sessions; the least recently used one is evicted first
+MAX_SESSIONS = 1000
+
+# In-memory storage per browser session (untuk development), keyed by session["sid"].
+# Kept in least-recently-used order, so idle and excess sessions are pruned from the front.
+_SESSIONS: OrderedDict[str, SessionState] = OrderedDict()
+_SESSIONS_LOCK = threading.Lock()
+
+
+def _prune_sessions(now):
+    """Drop idle sessions and evict the oldest ones beyond MAX_SESSIONS (caller holds the lock)"""
+    while _SESSIONS:
+        oldest = next(iter(_SESSIONS.values()))
+        if len(_SESSIONS) <= MAX_SESSIONS and now - oldest.last_access <= SESSION_IDLE_TIMEOUT:
+            break
+        _SESSIONS.popitem(last=False)
+
+
+def _state(create=False):
+    """
+    Return the SessionState of the current browser session
+    
+    Args:
+        create: Store a new state (and set the session cookie) if the browser has none yet.
+                Without it, such a browser gets an empty SessionState that is not kept.
+        
+    Returns:
+        SessionState: State of the current browser session
+    """
+    sid = session.get("sid")
+    now = time.monotonic()
+    with _SESSIONS_LOCK:
+        st = _SESSIONS.get(sid) if sid is not None else None
+        if st is not None:
+            _SESSIONS.move_to_end(sid)
+        elif not create:
+            return SessionState()
+        else:
+            if sid is None:
+                sid = session["sid"] = secrets.token_urlsafe(16)
+            st = _SESSIONS[sid] = SessionState()
+        st.last_access = now
+        _prune_sessions(now)
+    return st
+
+
+def ojson(payload, status=200):
+    """Serialize payload with orjson into a JSON response"""
+    return Response(orjson.dumps(payload), status=status, mimetype='application/json')
+
+
+def _request_json():
+    """Parse the JSON request body with orjson (None when the body is empty)"""
+    body = request.get_data(cache=False)
+    if not body:
+        return None
+    try:
+        return orjson.loads(body)
+    except orjson.JSONDecodeError:
+        raise BadRequest("Failed to decode JSON object")
+
+
+def _json_or_empty(response):
+    """Decode a JSON response body once, treating an empty or non-JSON body as {}"""
+    try:
+        return orjson.loads(response.content)
+    except ValueError:
+        return {}
+
+
+def _api_error(response):
+    """Error response for a failed Salesforce call, with the body excerpt capped at MAX_ERROR_DETAIL_BYTES"""
+    return ojson({
+        "success": False,
+        "error": f"API returned status {response.status_code}",
+        "details": response.content[:MAX_ERROR_DETAIL_BYTES].decode('utf-8', 'replace')
+    }, response.status_code)
+
+
+def _dummy_conversation_body():
+    """Return the encoded dummy conversation response, re-reading the file only if its mtime changed"""
+    mtime = os.stat(DUMMY_CONVERSATION_PATH).st_mtime_ns
+    if mtime != _dummy_conversation_cache["mtime"]:
+        with open(DUMMY_CONVERSATION_PATH, 'rb') as f:
+            conversation_data = orjson.loads(f.read())
+        _dummy_conversation_cache["body"] = orjson.dumps({
+            "success": True,
+            "conversation": conversation_data
+        })
+        _dummy_conversation_cache["mtime"] = mtime
+    return _dummy_conversation_cache["body"]
+
+
+# /api/status is polled and its body depends only on two session fields,
+# so the encoded bytes are cached per distinct pair of values.
+@lru_cache(maxsize=256)
+def _status_body(has_access_token, conversation_id):
+    """Encoded /api/status response for the given state"""
+    return orjson.dumps({
+        "has_access_token": has_access_token,
+        "has_conversation": conversation_id is not None,
+        "conversation_id": conversation_id
+    })
+
+
+def _uuid4_str():
+    """Random version-4 UUID string built straight from os.urandom, skipping uuid.UUID"""
+    b = bytearray(os.urandom(16))
+    b[6] = (b[6] & 0x0F) | 0x40  # version 4
+    b[8] = (b[8] & 0x3F) | 0x80  # RFC 4122 variant
+    h = b.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def _set_access_token(st, access_token, last_event_id, expires_at=None):
+    """Store a new access token and prebuild the request headers that carry it"""
+    st.access_token = access_token
+    st.last_event_id = last_event_id
+    st.access_token_exp = expires_at
+    st.auth_headers = {"Authorization": f"Bearer {access_token}"}
+
+
+def _token_deadline(data):
+    """Convert an access token response into a time.monotonic() refresh deadline"""
+    if data.get("expires_in") is not None:
+        remaining = float(data["expires_in"])
+    else:
+        exp = get_access_token_expiry(data.get("accessToken"))
+        if exp is None:
+            return None
+        remaining = exp - time.time()
+    return time.monotonic() + remaining - TOKEN_EXPIRY_SKEW
+
+
+def _token_is_fresh(st):
+    """Check whether the cached JWT-authenticated token can still be used"""
+    expires_at = st.access_token_exp
+    return bool(st.access_token) and expires_at is not None and time.monotonic() < expires_at
+
+
+def _refresh_access_token(st):
+    """Generate a new access token using JWT and cache it together with its expiry"""
+    success, response_data, status_code = generate_token_with_jwt(
+        SCRT_URL, ORG_ID, ES_DEVELOPER_NAME, KID, jwk_path=JWK_PATH, jwk=_JWK, signing_key=_PRIVATE_KEY
+    )
+    
+    if success:
+        data = response_data.get("data", {})
+        _set_access_token(st, data.get("accessToken"), data.get("lastEventId"), _token_deadline(data))
+    
+    return success, response_data, status_code
+
+
+def _get_or_refresh_token(st):
+    """
+    Regenerate the access token first if it is a JWT-authenticated token that is
+    about to expire. Tokens without a known expiry (unauthenticated flow) are used as-is.
+    
+    Returns:
+        tuple or None: (response dict, status code) of a failed refresh, otherwise None
+    """
+    if st.access_token and st.access_token_exp is not None and not _token_is_fresh(st):
+        success, response_data, status_code = _refresh_access_token(st)
+        if not success:
+            # Drop the expired token so it is never handed to a handler or the browser
+            st.access_token = None
+            st.access_token_exp = None
+            st.auth_headers = None
+            return response_data, status_code
+    return None
+
+
+# Preserialized bodies for the common "missing prerequisite" rejections
+_ERR_NO_TOKEN = orjson.dumps({
+    "success": False,
+    "error": "No access token available. Please generate access token first."
+})
+_ERR_NO_CONVERSATION = orjson.dumps({
+    "success": False,
+    "error": "No conversation available. Please create a conversation first."
+})
+
+
+def require_token_and_conv(need_conv=True):
+    """
+    Route decorator that rejects the request with 400 unless the session has an
+    access token (refreshed if expired) and, when need_conv is set, a conversation.
+    A failed refresh is returned to the client as-is.
+    The wrapped handler receives the SessionState as its first argument.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            st = _state()
+            refresh_error = _get_or_refresh_token(st)
+            if refresh_error is not None:
+                return ojson(*refresh_error)
+            if not st.access_token:
+                return Response(_ERR_NO_TOKEN, status=400, mimetype='application/json')
+            if need_conv and not st.conversation_id:
+                return Response(_ERR_NO_CONVERSATION, status=400, mimetype='application/json')
+            return fn(st, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def handle_request_entity_too_large(e):
+    """Return oversized request bodies as the usual JSON error instead of an HTML page"""
+    if request.endpoint == 'send_file':
+        error = "File too large. Maximum size is 5MB."
+    else:
+        error = "Request body too large."
+    return ojson({
+        "success": False,
+        "error": error
+    }, 413)
+
 
 @app.route('/')
 def index():
@@ -52,30 +356,38 @@ def index():
 @app.route('/api/generate-token', methods=['POST'])
 def generate_access_token_endpoint():
     """Generate Salesforce access token using JWT"""
+    st = _state(create=True)
     try:
+        # Reuse the cached token while it is still valid
+        if _token_is_fresh(st):
+            return ojson({
+                "success": True,
+                "cached": True,
+                "data": {
+                    "accessToken": st.access_token,
+                    "lastEventId": st.last_event_id
+                }
+            })
+        
         # Call auth module function using JWK file
-        success, response_data, status_code = generate_token_with_jwt(
-            SCRT_URL, ORG_ID, ES_DEVELOPER_NAME, KID, jwk_path=JWK_PATH
-        )
+        success, response_data, status_code = _refresh_access_token(st)
         
         if success:
-            # Store access token for later use
-            app_state["access_token"] = response_data.get("data", {}).get("accessToken")
-            app_state["last_event_id"] = response_data.get("data", {}).get("lastEventId")
-            return jsonify(response_data)
+            return ojson(response_data)
         else:
-            return jsonify(response_data), status_code
+            return ojson(response_data, status_code)
             
     except Exception as e:
-        return jsonify({
+        return ojson({
             "success": False,
             "error": str(e)
-        }), 500
+        }, 500)
 
 
 @app.route('/api/generate-token-unauthenticated', methods=['POST'])
 def generate_access_token_unauthenticated():
     """Generate Salesforce access token for unauthenticated users"""
+    st = _state(create=True)
     try:
         # Prepare request payload for Salesforce (unauthenticated flow)
         # Note: deviceId should be omitted for web apps
@@ -91,62 +403,47 @@ def generate_access_token_unauthenticated():
         }
         
         # Call Salesforce API (unauthenticated endpoint)
-        url = f"{SCRT_URL}/iamessage/api/v2/authorization/unauthenticated/access-token"
-        headers = {
-            "Content-Type": "application/json"
-        }
+        url = _URL_UNAUTHENTICATED_TOKEN
         
-        print(f"Calling Salesforce API (Unauthenticated): {url}")
-        print(f"Payload: {payload}")
+        log.info("Calling Salesforce API (Unauthenticated): %s", url)
+        log.debug("Payload: %s", payload)
         
-        response = requests.post(url, json=payload, headers=headers)
+        response = SF_SESSION.post(url, json=payload)
         
-        print(f"Response Status: {response.status_code}")
-        print(f"Response Body: {response.text}")
+        log_response(response)
         
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             # Store access token for later use
-            app_state["access_token"] = data.get("accessToken")
-            app_state["last_event_id"] = data.get("lastEventId")
+            _set_access_token(st, data.get("accessToken"), data.get("lastEventId"))
             
-            return jsonify({
+            return ojson({
                 "success": True,
                 "data": data
             })
         else:
-            return jsonify({
-                "success": False,
-                "error": f"API returned status {response.status_code}",
-                "details": response.text
-            }), response.status_code
+            return _api_error(response)
             
     except Exception as e:
-        return jsonify({
+        return ojson({
             "success": False,
             "error": str(e)
-        }), 500
+        }, 500)
 
 
 @app.route('/api/create-conversation', methods=['POST'])
-def create_conversation():
+@require_token_and_conv(need_conv=False)
+def create_conversation(st):
     """Create a new conversation"""
     try:
-        # Check if we have an access token
-        if not app_state["access_token"]:
-            return jsonify({
-                "success": False,
-                "error": "No access token available. Please generate access token first."
-            }), 400
-        
         # Get optional parameters from request
-        data = request.get_json() or {}
+        data = _request_json() or {}
         language = data.get("language", "en_US")
         routing_attributes = data.get("routingAttributes", {})
         
         # Generate conversation ID
-        conversation_id = str(uuid.uuid4())
-        app_state["conversation_id"] = conversation_id
+        conversation_id = _uuid4_str()
+        st.conversation_id = conversation_id
         
         # Prepare request payload
         payload = {
@@ -160,81 +457,60 @@ def create_conversation():
             payload["routingAttributes"] = routing_attributes
         
         # Call Salesforce API
-        url = f"{SCRT_URL}/iamessage/api/v2/conversation"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {app_state['access_token']}"
-        }
+        url = _URL_CONVERSATION
+        headers = st.auth_headers
         
-        print(f"Calling Salesforce API: {url}")
-        print(f"Payload: {payload}")
+        log.info("Calling Salesforce API: %s", url)
+        log.debug("Payload: %s", payload)
         
-        response = requests.post(url, json=payload, headers=headers)
+        response = SF_SESSION.post(url, json=payload, headers=headers)
         
-        print(f"Response Status: {response.status_code}")
-        print(f"Response Body: {response.text}")
+        log_response(response)
         
         if response.status_code in [200, 201]:
             # Extract channelAddressIdentifier from response if available
-            try:
-                response_data = response.json()
-                if "channelAddressIdentifier" in response_data:
-                    app_state["channel_address_identifier"] = response_data["channelAddressIdentifier"]
-            except:
-                pass
+            response_data = _json_or_empty(response)
+            if isinstance(response_data, dict) and "channelAddressIdentifier" in response_data:
+                st.channel_address_identifier = response_data["channelAddressIdentifier"]
             
-            return jsonify({
+            return ojson({
                 "success": True,
                 "conversationId": conversation_id,
                 "message": "Conversation created successfully",
                 "status_code": response.status_code,
-                "response": response.text if response.text else "Created"
+                "response": response.text or "Created"
             })
         else:
-            return jsonify({
-                "success": False,
-                "error": f"API returned status {response.status_code}",
-                "details": response.text
-            }), response.status_code
+            return _api_error(response)
             
+    except RequestEntityTooLarge:
+        # Body over MAX_CONTENT_LENGTH; let the 413 handler answer
+        raise
     except Exception as e:
-        return jsonify({
+        return ojson({
             "success": False,
             "error": str(e)
-        }), 500
+        }, 500)
 
 
 @app.route('/api/send-typing-indicator', methods=['POST'])
-def send_typing_indicator():
+@require_token_and_conv()
+def send_typing_indicator(st):
     """Send typing indicator to a conversation"""
     try:
-        # Check if we have an access token
-        if not app_state["access_token"]:
-            return jsonify({
-                "success": False,
-                "error": "No access token available. Please generate access token first."
-            }), 400
-        
-        # Check if we have a conversation ID
-        if not app_state["conversation_id"]:
-            return jsonify({
-                "success": False,
-                "error": "No conversation available. Please create a conversation first."
-            }), 400
-        
         # Get entry type from request
-        data = request.get_json() or {}
+        data = _request_json() or {}
         entry_type = data.get("entryType")
         
         # Validate entry type
-        if entry_type not in ["TypingStartedIndicator", "TypingStoppedIndicator"]:
-            return jsonify({
+        if not isinstance(entry_type, str) or entry_type not in _TYPING_INDICATOR_MESSAGES:
+            return ojson({
                 "success": False,
                 "error": "Invalid entryType. Must be 'TypingStartedIndicator' or 'TypingStoppedIndicator'."
-            }), 400
+            }, 400)
         
         # Generate unique ID for this typing indicator event
-        indicator_id = str(uuid.uuid4())
+        indicator_id = _uuid4_str()
         
         # Prepare request payload
         payload = {
@@ -242,74 +518,55 @@ def send_typing_indicator():
             "id": indicator_id
         }
         
-        # Call Salesforce API (conversationId must be lowercase)
-        conversation_id_lower = app_state["conversation_id"].lower()
-        url = f"{SCRT_URL}/iamessage/api/v2/conversation/{conversation_id_lower}/entry"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {app_state['access_token']}"
-        }
+        # Call Salesforce API (conversationId is a uuid4 string, already lowercase)
+        url = _URL_ENTRY_T({'cid': st.conversation_id})
+        headers = st.auth_headers
         
-        print(f"Calling Salesforce API: {url}")
-        print(f"Payload: {payload}")
+        log.info("Calling Salesforce API: %s", url)
+        log.debug("Payload: %s", payload)
         
-        response = requests.post(url, json=payload, headers=headers)
+        response = SF_SESSION.post(url, json=payload, headers=headers)
         
-        print(f"Response Status: {response.status_code}")
-        print(f"Response Body: {response.text}")
+        log_response(response)
         
         if response.status_code == 200:
-            return jsonify({
+            return ojson({
                 "success": True,
-                "message": f"Typing indicator sent: {entry_type}",
+                "message": _TYPING_INDICATOR_MESSAGES[entry_type],
                 "entryType": entry_type,
                 "indicatorId": indicator_id
             })
         else:
-            return jsonify({
-                "success": False,
-                "error": f"API returned status {response.status_code}",
-                "details": response.text
-            }), response.status_code
+            return _api_error(response)
             
+    except RequestEntityTooLarge:
+        # Body over MAX_CONTENT_LENGTH; let the 413 handler answer
+        raise
     except Exception as e:
-        return jsonify({
+        return ojson({
             "success": False,
             "error": str(e)
-        }), 500
+        }, 500)
 
 
 @app.route('/api/send-message', methods=['POST'])
-def send_message():
+@require_token_and_conv()
+def send_message(st):
     """Send a text message to a conversation"""
     try:
-        # Check if we have an access token
-        if not app_state["access_token"]:
-            return jsonify({
-                "success": False,
-                "error": "No access token available. Please generate access token first."
-            }), 400
-        
-        # Check if we have a conversation ID
-        if not app_state["conversation_id"]:
-            return jsonify({
-                "success": False,
-                "error": "No conversation available. Please create a conversation first."
-            }), 400
-        
         # Get message text from request
-        data = request.get_json() or {}
+        data = _request_json() or {}
         message_text = data.get("text", "").strip()
         
         # Validate message is not empty
         if not message_text:
-            return jsonify({
+            return ojson({
                 "success": False,
                 "error": "Message text cannot be empty."
-            }), 400
+            }, 400)
         
         # Generate unique ID for this message
-        message_id = str(uuid.uuid4())
+        message_id = _uuid4_str()
         
         # Prepare request payload with StaticContentMessage
         payload = {
@@ -325,94 +582,75 @@ def send_message():
             "language": "en_US"
         }
         
-        # Call Salesforce API (conversationId must be lowercase)
-        conversation_id_lower = app_state["conversation_id"].lower()
-        url = f"{SCRT_URL}/iamessage/api/v2/conversation/{conversation_id_lower}/message"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {app_state['access_token']}"
-        }
+        # Call Salesforce API (conversationId is a uuid4 string, already lowercase)
+        url = _URL_MESSAGE_T({'cid': st.conversation_id})
+        headers = st.auth_headers
         
-        print(f"Calling Salesforce API: {url}")
-        print(f"Payload: {payload}")
+        log.info("Calling Salesforce API: %s", url)
+        log.debug("Payload: %s", payload)
         
-        response = requests.post(url, json=payload, headers=headers)
+        response = SF_SESSION.post(url, json=payload, headers=headers)
         
-        print(f"Response Status: {response.status_code}")
-        print(f"Response Body: {response.text}")
+        log_response(response)
         
         if response.status_code == 202:
-            response_data = response.json() if response.text else {}
-            return jsonify({
+            response_data = _json_or_empty(response)
+            return ojson({
                 "success": True,
                 "message": "Message sent successfully",
                 "messageId": message_id,
                 "responseData": response_data
             })
         else:
-            return jsonify({
-                "success": False,
-                "error": f"API returned status {response.status_code}",
-                "details": response.text
-            }), response.status_code
+            return _api_error(response)
             
+    except RequestEntityTooLarge:
+        # Body over MAX_CONTENT_LENGTH; let the 413 handler answer
+        raise
     except Exception as e:
-        return jsonify({
+        return ojson({
             "success": False,
             "error": str(e)
-        }), 500
+        }, 500)
 
 
 @app.route('/api/send-file', methods=['POST'])
-def send_file():
+@require_token_and_conv()
+def send_file(st):
     """Send a file to a conversation"""
     try:
-        # Check if we have an access token
-        if not app_state["access_token"]:
-            return jsonify({
-                "success": False,
-                "error": "No access token available. Please generate access token first."
-            }), 400
-        
-        # Check if we have a conversation ID
-        if not app_state["conversation_id"]:
-            return jsonify({
-                "success": False,
-                "error": "No conversation available. Please create a conversation first."
-            }), 400
-        
         # Check if file was uploaded
         if 'file' not in request.files:
-            return jsonify({
+            return ojson({
                 "success": False,
                 "error": "No file uploaded."
-            }), 400
+            }, 400)
         
         file = request.files['file']
         caption = request.form.get('caption', '')
         
         # Check if file is empty
         if file.filename == '':
-            return jsonify({
+            return ojson({
                 "success": False,
                 "error": "No file selected."
-            }), 400
+            }, 400)
         
-        # Read file data
-        file_data = file.read()
-        file_size = len(file_data)
+        # Measure the upload without reading it into memory; the stream is sent as-is below
+        file.stream.seek(0, os.SEEK_END)
+        file_size = file.stream.tell()
+        file.stream.seek(0)
         
         # Validate file size (max 5MB)
-        MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB in bytes
         if file_size > MAX_FILE_SIZE:
-            return jsonify({
+            return ojson({
                 "success": False,
                 "error": f"File too large. Maximum size is 5MB. Your file is {file_size / 1024 / 1024:.2f}MB."
-            }), 400
+            }, 400)
         
         # Generate unique IDs
-        message_id = str(uuid.uuid4())
-        file_id = str(uuid.uuid4())
+        message_id = _uuid4_str()
+        file_id = _uuid4_str()
         
         # Prepare messageEntry JSON part
         message_entry = {
@@ -428,33 +666,28 @@ def send_file():
         if caption:
             message_entry["message"]["text"] = caption
         
-        # Call Salesforce API (conversationId must be lowercase)
-        conversation_id_lower = app_state["conversation_id"].lower()
-        url = f"{SCRT_URL}/iamessage/api/v2/conversation/{conversation_id_lower}/file"
-        
-        headers = {
-            "Authorization": f"Bearer {app_state['access_token']}"
-        }
+        # Call Salesforce API (conversationId is a uuid4 string, already lowercase)
+        url = _URL_FILE_T({'cid': st.conversation_id})
         
         # Prepare multipart form data
-        # The requests library handles multipart/form-data automatically when using 'files' parameter
-        files = {
+        # MultipartEncoder streams the file in chunks instead of building the whole body in memory
+        encoder = MultipartEncoder(fields={
             'messageEntry': (None, json.dumps(message_entry), 'application/json'),
-            'fileData': (file.filename, file_data, file.content_type or 'application/octet-stream')
-        }
+            'fileData': (file.filename, file.stream, file.content_type or 'application/octet-stream')
+        })
+        headers = {**st.auth_headers, "Content-Type": encoder.content_type}
         
-        print(f"Calling Salesforce API: {url}")
-        print(f"Message Entry: {message_entry}")
-        print(f"File: {file.filename}, Size: {file_size} bytes, Type: {file.content_type}")
+        log.info("Calling Salesforce API: %s", url)
+        log.debug("Message Entry: %s", message_entry)
+        log.info("File: %s, Size: %s bytes, Type: %s", file.filename, file_size, file.content_type)
         
-        response = requests.post(url, headers=headers, files=files)
+        response = SF_SESSION.post(url, headers=headers, data=encoder)
         
-        print(f"Response Status: {response.status_code}")
-        print(f"Response Body: {response.text}")
+        log_response(response)
         
         if response.status_code == 202:
-            response_data = response.json() if response.text else {}
-            return jsonify({
+            response_data = _json_or_empty(response)
+            return ojson({
                 "success": True,
                 "message": "File sent successfully",
                 "messageId": message_id,
@@ -464,359 +697,283 @@ def send_file():
                 "responseData": response_data
             })
         else:
-            return jsonify({
-                "success": False,
-                "error": f"API returned status {response.status_code}",
-                "details": response.text
-            }), response.status_code
+            return _api_error(response)
             
+    except RequestEntityTooLarge:
+        # Werkzeug enforces MAX_CONTENT_LENGTH while the form is parsed; let the 413 handler answer
+        raise
     except Exception as e:
-        return jsonify({
+        return ojson({
             "success": False,
             "error": str(e)
-        }), 500
+        }, 500)
 
 
 @app.route('/api/close-conversation', methods=['POST'])
-def close_conversation():
+@require_token_and_conv()
+def close_conversation(st):
     """Close a conversation permanently"""
     try:
-        # Check if we have an access token
-        if not app_state["access_token"]:
-            return jsonify({
-                "success": False,
-                "error": "No access token available. Please generate access token first."
-            }), 400
+        # Call Salesforce API (conversationId is a uuid4 string, already lowercase)
+        url = _URL_CLOSE_T({'cid': st.conversation_id})
+        headers = st.auth_headers
         
-        # Check if we have a conversation ID
-        if not app_state["conversation_id"]:
-            return jsonify({
-                "success": False,
-                "error": "No conversation available. Please create a conversation first."
-            }), 400
+        log.info("Calling Salesforce API: %s", url)
         
-        # Call Salesforce API (conversationId must be lowercase)
-        conversation_id_lower = app_state["conversation_id"].lower()
-        url = f"{SCRT_URL}/iamessage/api/v2/conversation/{conversation_id_lower}?esDeveloperName={ES_DEVELOPER_NAME}"
-        headers = {
-            "Authorization": f"Bearer {app_state['access_token']}"
-        }
+        response = SF_SESSION.delete(url, headers=headers)
         
-        print(f"Calling Salesforce API: {url}")
-        
-        response = requests.delete(url, headers=headers)
-        
-        print(f"Response Status: {response.status_code}")
-        print(f"Response Body: {response.text}")
+        log_response(response)
         
         if response.status_code == 204:
             # Clear conversation state since conversation is closed
-            app_state["conversation_id"] = None
-            return jsonify({
+            st.conversation_id = None
+            return ojson({
                 "success": True,
                 "message": "Conversation closed successfully"
             })
         else:
-            return jsonify({
-                "success": False,
-                "error": f"API returned status {response.status_code}",
-                "details": response.text
-            }), response.status_code
+            return _api_error(response)
             
     except Exception as e:
-        return jsonify({
+        return ojson({
             "success": False,
             "error": str(e)
-        }), 500
+        }, 500)
 
 
 @app.route('/api/end-session', methods=['POST'])
-def end_messaging_session():
+@require_token_and_conv()
+def end_messaging_session(st):
     """End the current messaging session (conversation remains open)"""
     try:
-        # Check if we have an access token
-        if not app_state["access_token"]:
-            return jsonify({
-                "success": False,
-                "error": "No access token available. Please generate access token first."
-            }), 400
-        
-        # Check if we have a conversation ID
-        if not app_state["conversation_id"]:
-            return jsonify({
-                "success": False,
-                "error": "No conversation available. Please create a conversation first."
-            }), 400
-        
-        # Call Salesforce API (conversationId must be lowercase)
-        conversation_id_lower = app_state["conversation_id"].lower()
-        url = f"{SCRT_URL}/iamessage/api/v2/conversation/{conversation_id_lower}/session?esDeveloperName={ES_DEVELOPER_NAME}"
-        headers = {
-            "Authorization": f"Bearer {app_state['access_token']}"
-        }
+        # Call Salesforce API (conversationId is a uuid4 string, already lowercase)
+        url = _URL_END_SESSION_T({'cid': st.conversation_id})
+        headers = st.auth_headers
         
-        print(f"Calling Salesforce API: {url}")
+        log.info("Calling Salesforce API: %s", url)
         
-        response = requests.delete(url, headers=headers)
+        response = SF_SESSION.delete(url, headers=headers)
         
-        print(f"Response Status: {response.status_code}")
-        print(f"Response Body: {response.text}")
+        log_response(response)
         
         if response.status_code == 204:
             # Keep conversation state since conversation is still open
-            return jsonify({
+            return ojson({
                 "success": True,
                 "message": "Messaging session ended successfully. Conversation remains open."
             })
         else:
-            return jsonify({
-                "success": False,
-                "error": f"API returned status {response.status_code}",
-                "details": response.text
-            }), response.status_code
+            return _api_error(response)
             
     except Exception as e:
-        return jsonify({
+        return ojson({
             "success": False,
             "error": str(e)
-        }), 500
+        }, 500)
 
 
 @app.route('/api/list-conversations', methods=['GET'])
-def list_conversations():
+@require_token_and_conv(need_conv=False)
+def list_conversations(st):
     """List all conversations for the current user"""
     try:
-        # Check if we have an access token
-        if not app_state["access_token"]:
-            return jsonify({
-                "success": False,
-                "error": "No access token available. Please generate access token first."
-            }), 400
-        
         # Get query parameters
         incl_closed = request.args.get('inclClosedConvs', 'false').lower() == 'true'
         limit = request.args.get('limit', '20')
         
         # Call Salesforce API
-        url = f"{SCRT_URL}/iamessage/api/v2/conversation/list"
+        url = _URL_CONVERSATION_LIST
         params = {
             'inclClosedConvs': str(incl_closed).lower(),
             'limit': limit
         }
-        headers = {
-            "Authorization": f"Bearer {app_state['access_token']}"
-        }
+        headers = st.auth_headers
         
-        print(f"Calling Salesforce API: {url}")
-        print(f"Params: {params}")
+        log.info("Calling Salesforce API: %s", url)
+        log.debug("Params: %s", params)
         
-        response = requests.get(url, headers=headers, params=params)
+        response = SF_SESSION.get(url, headers=headers, params=params)
         
-        print(f"Response Status: {response.status_code}")
-        print(f"Response Body: {response.text}")
+        log_response(response)
         
         if response.status_code == 200:
-            data = response.json()
-            return jsonify({
+            data = orjson.loads(response.content)
+            return ojson({
                 "success": True,
                 "data": data
             })
         else:
-            return jsonify({
-                "success": False,
-                "error": f"API returned status {response.status_code}",
-                "details": response.text
-            }), response.status_code
+            return _api_error(response)
             
     except Exception as e:
-        return jsonify({
+        return ojson({
             "success": False,
             "error": str(e)
-        }), 500
+        }, 500)
 
 
 @app.route('/api/list-conversation-entries/<conversation_id>', methods=['GET'])
-def list_conversation_entries(conversation_id):
+@require_token_and_conv(need_conv=False)
+def list_conversation_entries(st, conversation_id):
     """List entries for a specific conversation"""
     try:
-        # Check if we have an access token
-        if not app_state["access_token"]:
-            return jsonify({
-                "success": False,
-                "error": "No access token available. Please generate access token first."
-            }), 400
-        
         # Get query parameters
         limit = request.args.get('limit', '20')
         direction = request.args.get('direction', 'FromEnd')
         
         # Call Salesforce API (conversationId must be lowercase)
-        conversation_id_lower = conversation_id.lower()
-        url = f"{SCRT_URL}/iamessage/api/v2/conversation/{conversation_id_lower}/entries"
+        url = _URL_ENTRIES_T({'cid': conversation_id.lower()})
         params = {
             'limit': limit,
             'direction': direction
         }
-        headers = {
-            "Authorization": f"Bearer {app_state['access_token']}"
-        }
+        headers = st.auth_headers
         
-        print(f"Calling Salesforce API: {url}")
-        print(f"Params: {params}")
+        log.info("Calling Salesforce API: %s", url)
+        log.debug("Params: %s", params)
         
-        response = requests.get(url, headers=headers, params=params)
+        response = SF_SESSION.get(url, headers=headers, params=params)
         
-        print(f"Response Status: {response.status_code}")
-        print(f"Response Body: {response.text}")
+        log_response(response)
         
         if response.status_code == 200:
-            data = response.json()
-            return jsonify({
+            data = orjson.loads(response.content)
+            return ojson({
                 "success": True,
                 "data": data
             })
         else:
-            return jsonify({
-                "success": False,
-                "error": f"API returned status {response.status_code}",
-                "details": response.text
-            }), response.status_code
+            return _api_error(response)
             
     except Exception as e:
-        return jsonify({
+        return ojson({
             "success": False,
             "error": str(e)
-        }), 500
+        }, 500)
 
 
 @app.route('/api/sse-config', methods=['GET'])
-def get_sse_config():
+@require_token_and_conv()
+def get_sse_config(st):
     """Get SSE connection configuration"""
     try:
-        # Check if we have an access token
-        if not app_state["access_token"]:
-            return jsonify({
-                "success": False,
-                "error": "No access token available. Please generate access token first."
-            }), 400
-        
-        # Check if we have a conversation ID
-        if not app_state["conversation_id"]:
-            return jsonify({
-                "success": False,
-                "error": "No conversation available. Please create a conversation first."
-            }), 400
-        
         # Prepare SSE configuration
-        sse_url = f"{SCRT_URL}/eventrouter/v1/sse"
-        conversation_id_lower = app_state["conversation_id"].lower()
+        conversation_id = st.conversation_id
         
         # Use channel_address_identifier if available, otherwise use conversation_id
-        channel_address = app_state.get("channel_address_identifier") or conversation_id_lower
+        channel_address = st.channel_address_identifier or conversation_id
         
         config = {
             "success": True,
-            "sse_url": sse_url,
-            "access_token": app_state["access_token"],
+            "sse_url": _URL_SSE,
+            "access_token": st.access_token,
             "org_id": ORG_ID,
             "query_params": {
                 "channelType": "embedded_messaging",
                 "channelAddressIdentifier": channel_address,
-                "conversationId": conversation_id_lower,
+                "conversationId": conversation_id,
                 "channelPlatformKey": "web-simulator"  # Can be any identifier
             }
         }
         
-        return jsonify(config)
+        return ojson(config)
             
     except Exception as e:
-        return jsonify({
+        return ojson({
             "success": False,
             "error": str(e)
-        }), 500
+        }, 500)
 
 
 @app.route('/api/generate-oauth-token', methods=['POST'])
 def generate_oauth_token_endpoint():
-    """Generate OAuth 2.0 access token using Client Credentials flow"""
+    """Generate OAuth 2.0 access token using Client Credentials flow (?refresh=1 skips the cache)"""
     oauth_config = {
         'token_url': OAUTH_TOKEN_URL,
         'client_id': OAUTH_CLIENT_ID,
         'client_secret': OAUTH_CLIENT_SECRET
     }
     
-    result = get_oauth_token(oauth_config)
+    result = get_oauth_token(oauth_config, force_refresh=request.args.get('refresh') == '1')
     
     if isinstance(result, tuple):
         # Error case
-        return jsonify(result[0]), result[1]
+        return ojson(result[0], result[1])
     else:
         # Success case
-        return jsonify(result)
+        return ojson(result)
 
 
 @app.route('/api/send-conversation-history', methods=['POST'])
 def send_conversation_history_endpoint():
     """Send chatbot conversation history to Enhanced Chat"""
+    st = _state()
+    # Without an X-OAuth-Token header the session token is sent, so refresh it like the decorated routes do
+    if not request.headers.get('X-OAuth-Token'):
+        refresh_error = _get_or_refresh_token(st)
+        if refresh_error is not None:
+            return ojson(*refresh_error)
+    
     response_data, status_code = handle_send_conversation_history(
-        request, app_state, SCRT_URL, ORG_ID, ES_DEVELOPER_NAME
+        request, st, SCRT_URL, ORG_ID, ES_DEVELOPER_NAME
     )
-    return jsonify(response_data), status_code
+    return ojson(response_data, status_code)
 
 
 @app.route('/api/send-history-standard', methods=['POST'])
 def send_conversation_history_standard_endpoint():
     """Send chatbot conversation history via Standard API (PATCH MessagingSession.Bot_Transcript__c)"""
+    st = _state()
     # Get OAuth token from custom header
     oauth_token = request.headers.get('X-OAuth-Token')
     if not oauth_token:
-        return jsonify({
+        return ojson({
             "success": False,
             "error": "No OAuth token provided. Include X-OAuth-Token header."
-        }), 400
+        }, 400)
 
     # Get instance URL from request body
-    data = request.get_json()
+    data = _request_json()
     if not data:
-        return jsonify({
+        return ojson({
             "success": False,
             "error": "No request body provided"
-        }), 400
+        }, 400)
 
     instance_url = data.get("instanceUrl", "").rstrip("/")
     if not instance_url:
-        return jsonify({
+        return ojson({
             "success": False,
             "error": "instanceUrl is required"
-        }), 400
+        }, 400)
 
     messaging_session_id = data.get("messagingSessionId", "").strip()
     if not messaging_session_id:
-        return jsonify({
+        return ojson({
             "success": False,
             "error": "messagingSessionId is required"
-        }), 400
+        }, 400)
 
     conversation_data = data.get("conversation", {})
     if not conversation_data:
-        return jsonify({
+        return ojson({
             "success": False,
             "error": "conversation data is required"
-        }), 400
+        }, 400)
 
-    # Include the conversationId from app_state in the transcript header
-    conversation_id = app_state.get("conversation_id", "")
+    # Include the conversationId from the session state in the transcript header
+    conversation_id = st.conversation_id
     if conversation_id:
         conversation_data["_conversationId"] = conversation_id
 
     # Format transcript
     transcript_text = format_conversation_as_transcript(conversation_data)
 
-    print(f"Sending history via Standard API")
-    print(f"MessagingSession ID: {messaging_session_id}")
-    print(f"Instance URL: {instance_url}")
-    print(f"Conversation ID (from state): {conversation_id}")
-    print(f"Transcript:\n{transcript_text}")
+    log.info("Sending history via Standard API")
+    log.info("MessagingSession ID: %s", messaging_session_id)
+    log.info("Instance URL: %s", instance_url)
+    log.info("Conversation ID (from state): %s", conversation_id)
+    log.debug("Transcript:\n%s", transcript_text)
 
     success, response_data, status_code = send_history_via_standard_api(
         oauth_token, instance_url, messaging_session_id, transcript_text
@@ -826,41 +983,33 @@ def send_conversation_history_standard_endpoint():
     if conversation_id:
         response_data["conversationId"] = conversation_id
 
-    return jsonify(response_data), status_code
+    return ojson(response_data, status_code)
 
 
 @app.route('/api/status', methods=['GET'])
 def get_status():
     """Get current application state"""
-    return jsonify({
-        "has_access_token": app_state["access_token"] is not None,
-        "has_conversation": app_state["conversation_id"] is not None,
-        "conversation_id": app_state["conversation_id"]
-    })
+    st = _state()
+    body = _status_body(st.access_token is not None, st.conversation_id)
+    return Response(body, mimetype='application/json')
 
 
 @app.route('/api/load-dummy-conversation', methods=['GET'])
 def load_dummy_conversation():
     """Load dummy IM3 conversation for testing"""
     try:
-        # Read dummy conversation file
-        with open('dummy_im3_network_conversation.json', 'r', encoding='utf-8') as f:
-            conversation_data = json.load(f)
-        
-        return jsonify({
-            "success": True,
-            "conversation": conversation_data
-        })
+        # Serve the cached, already-encoded dummy conversation
+        return Response(_dummy_conversation_body(), mimetype='application/json')
     except FileNotFoundError:
-        return jsonify({
+        return ojson({
             "success": False,
             "error": "Dummy conversation file not found"
-        }), 404
+        }, 404)
     except Exception as e:
-        return jsonify({
+        return ojson({
             "success": False,
             "error": str(e)
-        }), 500
+        }, 500)
 
 
 @app.route('/history')
@@ -875,16 +1024,26 @@ def conversations_page():
     return render_template('conversations.html')
 
 
-if __name__ == '__main__':
+def print_startup_banner(port, server_label=None):
+    """Print the configuration summary shown when a server entry point starts"""
+    title = "Salesforce Enhanced Chat API Simulator"
+    if server_label:
+        title = f"{title} ({server_label})"
+    
     print("=" * 60)
-    print("Salesforce Enhanced Chat API Simulator")
+    print(title)
     print("=" * 60)
     print(f"SCRT URL: {SCRT_URL}")
     print(f"Org ID: {ORG_ID}")
     print(f"ES Developer Name: {ES_DEVELOPER_NAME}")
     print(f"JWK Path: {JWK_PATH}")
     print("=" * 60)
-    print("\nStarting server on http://localhost:5001")
+    print(f"\nStarting server on http://localhost:{port}")
     print("\n")
+
+
+if __name__ == '__main__':
+    print_startup_banner(5001)
     
-    app.run(debug=True, host='0.0.0.0', port=5001)
+    # Debugger and reloader are opt-in; set FLASK_DEBUG=1 while developing
+    app.run(debug=os.getenv("FLASK_DEBUG") == "1", threaded=True, host='0.0.0.0', port=5001)
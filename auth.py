@@ -6,31 +6,89 @@ for Salesforce Enhanced Chat API authentication.
 """
 
 import jwt
-import uuid
+import orjson
+import os
 import time
 import json
-import requests
-from datetime import datetime, timedelta
-from jwt.algorithms import RSAAlgorithm
+import logging
+from functools import lru_cache
+from cryptography.hazmat.primitives.asymmetric.ec import EllipticCurvePrivateKey
+from jwt.algorithms import ECAlgorithm, RSAAlgorithm
+from jwt.api_jws import PyJWS
 
+log = logging.getLogger(__name__)
 
-def load_private_key_from_jwk(jwk_path):
-    """Load private key from JWK JSON file"""
-    try:
-        with open(jwk_path, 'r') as f:
-            jwk_data = json.load(f)
+# Signs pre-encoded JWT payloads; created once instead of going through jwt.encode per token
+_JWS = PyJWS()
+
+# JWS algorithm for each elliptic curve; RSA keys always sign with RS256
+_EC_ALGORITHMS = {
+    "secp256r1": "ES256",
+    "secp384r1": "ES384",
+    "secp521r1": "ES512",
+}
+
+
+@lru_cache(maxsize=8)
+def _load_key_cached(jwk_path, mtime_ns):
+    """Read and convert a JWK file; cached per (path, mtime) so an edited file is picked up"""
+    with open(jwk_path, 'r') as f:
+        jwk_data = json.load(f)
+    return _key_from_jwk(jwk_data)
+
+
+def _key_from_jwk(jwk_data):
+    """Convert a parsed JWK into a private key object (EC for kty "EC", RSA otherwise)"""
+    if jwk_data.get("kty") == "EC":
+        return ECAlgorithm.from_jwk(json.dumps(jwk_data))
+    return RSAAlgorithm.from_jwk(json.dumps(jwk_data))
+
+
+def signing_algorithm_for_key(private_key):
+    """
+    Pick the JWS algorithm that matches a private key
+    
+    Args:
+        private_key: RSA or elliptic curve private key object
         
-        # Convert JWK to private key object using PyJWT's RSAAlgorithm
-        private_key = RSAAlgorithm.from_jwk(json.dumps(jwk_data))
+    Returns:
+        str: "ES256"/"ES384"/"ES512" for EC keys, "RS256" for RSA keys
+    """
+    if isinstance(private_key, EllipticCurvePrivateKey):
+        algorithm = _EC_ALGORITHMS.get(private_key.curve.name)
+        if algorithm is None:
+            raise ValueError(f"Unsupported EC curve: {private_key.curve.name}")
+        return algorithm
+    return "RS256"
+
+
+@lru_cache(maxsize=32)
+def _base_payload(scrt_url, kid, subject):
+    """Claims that stay the same for every JWT issued to a given subject"""
+    return {
+        "sub": subject,  # Subject - user identifier
+        "aud": scrt_url,   # Audience - SCRT URL (not Org ID)
+        "iss": kid,  # Issuer - use KID as issuer
+        "name": "Test User",  # User display name
+    }
+
+
+def load_private_key_from_jwk(jwk_path, jwk=None):
+    """Load private key from JWK JSON file (or an already-parsed JWK dict)"""
+    try:
+        if jwk is not None:
+            # Convert JWK to private key object using PyJWT's RSA/EC algorithms
+            return _key_from_jwk(jwk)
         
-        return private_key
+        # Reuse the key object from an earlier call unless the file has changed
+        return _load_key_cached(jwk_path, os.stat(jwk_path).st_mtime_ns)
     except FileNotFoundError:
         raise Exception(f"JWK file not found at {jwk_path}. Please add your JWK file.")
     except Exception as e:
         raise Exception(f"Error loading JWK: {str(e)}")
 
 
-def generate_jwt(scrt_url, kid, jwk_path, subject="user123"):
+def generate_jwt(scrt_url, kid, jwk_path, subject="user123", jwk=None, signing_key=None, algorithm=None):
     """
     Generate JWT token for Salesforce authentication using JWK
     
@@ -39,43 +97,41 @@ def generate_jwt(scrt_url, kid, jwk_path, subject="user123"):
         kid: Key ID for JWT header
         jwk_path: Path to JWK file (JSON format)
         subject: Subject identifier (default: "user123")
+        jwk: Already-parsed JWK dict; skips reading jwk_path when provided
+        signing_key: Already-loaded private key; skips JWK parsing when provided
+        algorithm: JWS algorithm; defaults to ES256 for a P-256 EC key, RS256 for RSA
         
     Returns:
         str: Generated JWT token
     """
     try:
-        # Load private key from JWK
-        private_key = load_private_key_from_jwk(jwk_path)
-        
-        # JWT payload
-        # Use current time for timestamps
-        now = datetime.utcnow()
-        current_timestamp = int(time.time())
+        # Load private key from JWK (unless the caller already holds it)
+        if signing_key is not None:
+            private_key = signing_key
+        else:
+            private_key = load_private_key_from_jwk(jwk_path, jwk=jwk)
         
-        # Set IAT (issued at) to current time
-        iat_timestamp = current_timestamp
+        if algorithm is None:
+            algorithm = signing_algorithm_for_key(private_key)
         
-        # Set EXP (expiration) to 5 minutes from now
-        exp_timestamp = current_timestamp + 300
+        # JWT payload: constant claims plus timestamps based on the current time
+        iat_timestamp = int(time.time())
         
         payload = {
-            "sub": subject,  # Subject - user identifier
-            "aud": scrt_url,   # Audience - SCRT URL (not Org ID)
-            "iss": kid,  # Issuer - use KID as issuer
+            **_base_payload(scrt_url, kid, subject),
             "iat": iat_timestamp,  # Issued at
             "nbf": iat_timestamp,  # Not before (same as iat)
-            "exp": exp_timestamp,  # Expiration
-            "name": "Test User",  # User display name
+            "exp": iat_timestamp + 300,  # Expiration - 5 minutes from now
         }
         
-        print(f"Current time: {now}")
-        print(f"JWT Payload: {payload}")
-        
-        # Generate JWT with kid in header
-        token = jwt.encode(
-            payload, 
+        # Generate JWT with kid in header.
+        # The payload is encoded with orjson and signed directly by PyJWS.
+        # The key object is passed as-is: PyJWT uses it directly, whereas PEM bytes
+        # would be parsed (and the RSA key re-validated) again on every call.
+        token = _JWS.encode(
+            orjson.dumps(payload), 
             private_key, 
-            algorithm="RS256",
+            algorithm=algorithm,
             headers={"kid": kid}  # Include Key ID in JWT header
         )
         return token
@@ -83,7 +139,7 @@ def generate_jwt(scrt_url, kid, jwk_path, subject="user123"):
         raise Exception(f"Error generating JWT: {str(e)}")
 
 
-def generate_access_token(scrt_url, org_id, es_developer_name, kid, jwk_path, subject="user123"):
+def generate_access_token(scrt_url, org_id, es_developer_name, kid, jwk_path, subject="user123", jwk=None, signing_key=None):
     """
     Generate Salesforce access token using JWT with JWK
     
@@ -94,13 +150,20 @@ def generate_access_token(scrt_url, org_id, es_developer_name, kid, jwk_path, su
         kid: Key ID for JWT header
         jwk_path: Path to JWK file (JSON format)
         subject: Subject identifier (default: "user123")
+        jwk: Already-parsed JWK dict; skips reading jwk_path when provided
+        signing_key: Already-loaded private key; skips JWK parsing when provided
         
     Returns:
         tuple: (success bool, response dict, status code)
     """
     try:
+        # Imported here so JWT-only callers (e.g. test_jwt.py) never load requests
+        from http_client import log_response, post_json
+        
         # Generate JWT
-        customer_identity_token = generate_jwt(scrt_url, kid, jwk_path, subject=subject)
+        customer_identity_token = generate_jwt(
+            scrt_url, kid, jwk_path, subject=subject, jwk=jwk, signing_key=signing_key
+        )
         
         # Prepare request payload for Salesforce
         payload = {
@@ -118,20 +181,16 @@ def generate_access_token(scrt_url, org_id, es_developer_name, kid, jwk_path, su
         
         # Call Salesforce API
         url = f"{scrt_url}/iamessage/api/v2/authorization/authenticated/access-token"
-        headers = {
-            "Content-Type": "application/json"
-        }
         
-        print(f"Calling Salesforce API: {url}")
-        print(f"Payload: {payload}")
+        log.info("Calling Salesforce API: %s", url)
+        log.debug("Payload: %s", payload)
         
-        response = requests.post(url, json=payload, headers=headers)
+        response = post_json(url, payload)
         
-        print(f"Response Status: {response.status_code}")
-        print(f"Response Body: {response.text}")
+        log_response(response)
         
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             return True, {
                 "success": True,
                 "data": data,
@@ -151,6 +210,23 @@ def generate_access_token(scrt_url, org_id, es_developer_name, kid, jwk_path, su
         }, 500
 
 
+def get_access_token_expiry(access_token):
+    """
+    Read the expiration time of a Salesforce access token
+    
+    Args:
+        access_token: Access token returned by Salesforce (a JWT)
+        
+    Returns:
+        int or None: Expiration as epoch seconds, or None if it cannot be read
+    """
+    try:
+        claims = jwt.decode(access_token, options={"verify_signature": False})
+        return claims.get("exp")
+    except jwt.PyJWTError:
+        return None
+
+
 def validate_access_token(access_token):
     """
     Validate if access token exists
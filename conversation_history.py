@@ -5,23 +5,101 @@ This module handles sending chatbot conversation history to Salesforce Enhanced
 using OAuth 2.0 Client Credentials authentication and the Interaction Service API.
 """
 
+import os
 import uuid
 import time
 import json
-import requests
+import logging
+import threading
+import orjson
 
+from http_client import SF_SESSION, log_response, post_json
 
-def generate_oauth_token(oauth_config):
+log = logging.getLogger(__name__)
+
+# Refresh cached OAuth tokens this many seconds before they expire
+OAUTH_EXPIRY_SKEW = 30
+
+# Lifetime assumed for an OAuth token whose response has no expires_in. Salesforce
+# client-credentials responses usually omit it, and an org's session timeout can be
+# as short as 15 minutes, so stay below that.
+OAUTH_DEFAULT_TTL = 600
+
+# OAuth tokens keyed by (token_url, client_id): (token result dict, time.monotonic() deadline)
+_OAUTH_CACHE = {}
+_OAUTH_CACHE_LOCK = threading.Lock()
+
+# Constant request headers; per-call values (Authorization, OrgId, RequestId) are added on top.
+# Content-Type comes from post_json.
+_ESTABLISH_HEADERS = {
+    "AuthorizationContext": "Infobip_Chatbot"
+}
+_SEND_HISTORY_HEADERS = {
+    "AuthorizationContext": "Infobip_Chatbot",
+    "AuthorizationContextType": "EmbeddedMessagingChannel"
+}
+
+
+class _LazyJSON:
+    """Pretty-prints a payload only when a log record actually gets formatted"""
+    __slots__ = ("payload",)
+    
+    def __init__(self, payload):
+        self.payload = payload
+    
+    def __str__(self):
+        return json.dumps(self.payload, indent=2)
+
+
+def _uuid_batch(n):
+    """Generate n random version-4 UUID strings from a single os.urandom read"""
+    buf = os.urandom(16 * n)
+    return [str(uuid.UUID(bytes=buf[i * 16:(i + 1) * 16], version=4)) for i in range(n)]
+
+
+# Random node for RequestId UUIDs, drawn once per process; the multicast bit marks it
+# as not being a real MAC address (RFC 4122 section 4.5), so no hardware address is sent
+_REQUEST_ID_NODE = int.from_bytes(os.urandom(6), "big") | 0x010000000000
+
+
+def _request_id():
+    """Unique RequestId header value: a time-based UUID, no per-call random read needed"""
+    return str(uuid.uuid1(node=_REQUEST_ID_NODE))
+
+
+def invalidate_oauth_token(access_token):
+    """
+    Forget a cached OAuth token, e.g. after Salesforce rejected it with 401
+    
+    Args:
+        access_token: Token to drop from the cache (ignored if it is not cached)
+    """
+    with _OAUTH_CACHE_LOCK:
+        for key, (result, _) in list(_OAUTH_CACHE.items()):
+            if result.get('access_token') == access_token:
+                del _OAUTH_CACHE[key]
+
+
+def generate_oauth_token(oauth_config, force_refresh=False):
     """
     Generate OAuth 2.0 access token using Client Credentials flow
     
     Args:
         oauth_config: Dictionary with token_url, client_id, client_secret
+        force_refresh: Request a new token even if a cached one is still valid
         
     Returns:
         dict: Response with success status and token data
+              ('cached' tells whether the token came from the in-memory cache)
     """
     try:
+        # Reuse the previous token while it is still valid
+        cache_key = (oauth_config['token_url'], oauth_config['client_id'])
+        with _OAUTH_CACHE_LOCK:
+            cached = _OAUTH_CACHE.get(cache_key)
+        if not force_refresh and cached is not None and time.monotonic() < cached[1]:
+            return {**cached[0], 'cached': True}
+        
         # Prepare request data (form-urlencoded format)
         data = {
             'grant_type': 'client_credentials',
@@ -29,28 +107,29 @@ def generate_oauth_token(oauth_config):
             'client_secret': oauth_config['client_secret']
         }
         
-        headers = {
-            'Content-Type': 'application/x-www-form-urlencoded'
-        }
-        
-        print(f"Requesting OAuth token from: {oauth_config['token_url']}")
-        print(f"Client ID: {oauth_config['client_id'][:20]}...")
+        log.info("Requesting OAuth token from: %s", oauth_config['token_url'])
+        log.debug("Client ID: %s...", oauth_config['client_id'][:20])
         
-        # Request token
-        response = requests.post(oauth_config['token_url'], data=data, headers=headers)
+        # Request token (requests sends the dict form-urlencoded with the matching Content-Type)
+        response = SF_SESSION.post(oauth_config['token_url'], data=data)
         
-        print(f"OAuth Response Status: {response.status_code}")
-        print(f"OAuth Response Body: {response.text}")
+        log_response(response, "OAuth Response")
         
         if response.status_code == 200:
-            token_data = response.json()
-            return {
+            token_data = orjson.loads(response.content)
+            result = {
                 'success': True,
                 'access_token': token_data.get('access_token'),
                 'token_type': token_data.get('token_type', 'Bearer'),
                 'instance_url': token_data.get('instance_url'),
                 'scope': token_data.get('scope', '')
             }
+            
+            expires_in = float(token_data.get('expires_in') or OAUTH_DEFAULT_TTL)
+            with _OAUTH_CACHE_LOCK:
+                _OAUTH_CACHE[cache_key] = (result, time.monotonic() + expires_in - OAUTH_EXPIRY_SKEW)
+            
+            return {**result, 'cached': False}
         else:
             return {
                 'success': False,
@@ -82,7 +161,7 @@ def establish_conversation(access_token, channel_address, participants, org_id,
     """
     try:
         # Generate unique request ID
-        request_id = str(uuid.uuid4())
+        request_id = _request_id()
         
         # Call Salesforce establish conversation API
         url = f"{scrt_url}/api/v1/conversation"
@@ -112,24 +191,26 @@ def establish_conversation(access_token, channel_address, participants, org_id,
         }
         
         headers = {
-            "Content-Type": "application/json",
+            **_ESTABLISH_HEADERS,
             "Authorization": f"Bearer {access_token}",
             "OrgId": org_id,
-            "RequestId": request_id,
-            "AuthorizationContext": "Infobip_Chatbot"
+            "RequestId": request_id
         }
         
-        print(f"Establishing conversation at: {url}")
-        print(f"Headers: {headers}")
-        print(f"Payload: {json.dumps(payload, indent=2)}")
+        log.info("Establishing conversation at: %s", url)
+        log.debug("Headers: %s", headers)
+        log.debug("Payload: %s", _LazyJSON(payload))
+        
+        response = post_json(url, payload, headers)
         
-        response = requests.post(url, json=payload, headers=headers)
+        log_response(response, "Establish Conversation Response")
         
-        print(f"Establish Conversation Response Status: {response.status_code}")
-        print(f"Establish Conversation Response Body: {response.text}")
+        # A rejected token must not be served from the cache again
+        if response.status_code == 401:
+            invalidate_oauth_token(access_token)
         
         if response.status_code in [200, 201]:
-            response_data = response.json()
+            response_data = orjson.loads(response.content)
             conversation_identifier = response_data.get("conversationIdentifier")
             messaging_session_id = response_data.get("messagingSessionId")
             
@@ -141,7 +222,7 @@ def establish_conversation(access_token, channel_address, participants, org_id,
         return False, None, None, str(e)
 
 
-def transform_conversation_to_salesforce_format(data, scrt_url, org_id, es_developer_name, app_state):
+def transform_conversation_to_salesforce_format(data, scrt_url, org_id, es_developer_name, app_state, channel_address=None):
     """
     Transform simple conversation format to Salesforce API format
     
@@ -150,17 +231,23 @@ def transform_conversation_to_salesforce_format(data, scrt_url, org_id, es_devel
         scrt_url: Salesforce SCRT URL
         org_id: Organization ID
         es_developer_name: ES Developer Name
-        app_state: Application state dict
+        app_state: Session state of the current browser (app.SessionState)
+        channel_address: Channel address already used to establish the conversation;
+                         derived from app_state when not provided
         
     Returns:
         tuple: (payload dict, error message or None)
     """
     try:
+        # Current timestamp (ms) shared by participants, entries and the messaging session
+        now_ms_str = str(time.time_ns() // 1_000_000)
+        
         # Get channel address
         # When using OAuth flow, conversation_id might be None
-        channel_address = app_state.get("channel_address_identifier")
         if not channel_address:
-            conversation_id = app_state.get("conversation_id")
+            channel_address = app_state.channel_address_identifier
+        if not channel_address:
+            conversation_id = app_state.conversation_id
             if conversation_id:
                 channel_address = conversation_id.lower()
             else:
@@ -182,23 +269,28 @@ def transform_conversation_to_salesforce_format(data, scrt_url, org_id, es_devel
                     "role": role,
                     "appType": app_type
                 },
-                "joinedTime": str(int(time.time() * 1000))  # Use current timestamp
+                "joinedTime": now_ms_str  # Use current timestamp
             })
         
         # Build conversation entries (reverse order - newest first)
         messages = data.get("messages", [])
         conversation_entries = []
         
-        # Take only first 5 messages (API limit)
-        messages_to_send = messages[:5]
+        # Take only first 5 messages (API limit), reversed for API (newest first).
+        # The negative stride also handles fewer than 5 messages: [4::-1] starts at the last one.
+        messages_to_send = messages[4::-1]
         
-        # Reverse order for API (newest first)
-        messages_to_send.reverse()
+        # One unique ID per message, generated up front
+        msg_ids = _uuid_batch(len(messages_to_send))
         
-        # Use current timestamp for all messages to avoid validation errors
-        current_timestamp = int(time.time() * 1000)
+        # First participant of each role, so senders are looked up instead of re-scanned per message
+        by_role = {}
+        for p in participants_data:
+            by_role.setdefault(p.get("role"), p)
+        chatbot = by_role.get("Chatbot")
+        end_user = by_role.get("EndUser")
         
-        for msg in messages_to_send:
+        for i, msg in enumerate(messages_to_send):
             # Determine sender
             sender_role = "EndUser"
             sender_subject = ""
@@ -206,25 +298,20 @@ def transform_conversation_to_salesforce_format(data, scrt_url, org_id, es_devel
             
             if msg.get("sender") == "bot":
                 sender_role = "Chatbot"
-                # Find chatbot participant
-                for p in participants_data:
-                    if p.get("role") == "Chatbot":
-                        sender_subject = p.get("subject", "")
-                        sender_app_type = p.get("appType", "custom")
-                        break
+                # Use chatbot participant
+                if chatbot:
+                    sender_subject = chatbot.get("subject", "")
+                    sender_app_type = chatbot.get("appType", "custom")
             else:
-                # Find user participant - set appType to iamessage for EndUser
+                # Use user participant - set appType to iamessage for EndUser
                 sender_app_type = "iamessage"
-                for p in participants_data:
-                    if p.get("role") == "EndUser":
-                        sender_subject = p.get("subject", "")
-                        break
+                if end_user:
+                    sender_subject = end_user.get("subject", "")
             
-            # Generate unique message ID
-            msg_id = str(uuid.uuid4())
+            msg_id = msg_ids[i]
             
             entry = {
-                "clientTimestamp": str(current_timestamp),  # Use current timestamp to avoid validation errors
+                "clientTimestamp": now_ms_str,  # Use current timestamp to avoid validation errors
                 "entryPayload": {
                     "entryType": "Message",
                     "id": msg_id,
@@ -246,11 +333,10 @@ def transform_conversation_to_salesforce_format(data, scrt_url, org_id, es_devel
             conversation_entries.append(entry)
         
         # Build messaging session
-        current_time = int(time.time() * 1000)  # Use current timestamp
         messaging_session = {
             "messagingSessionRequestType": "EstablishMessagingSession",
             "payload": {
-                "startTime": str(current_time)
+                "startTime": now_ms_str  # Use current timestamp
             }
         }
         
@@ -284,30 +370,31 @@ def send_history_to_salesforce(payload, access_token, scrt_url, org_id, es_devel
     """
     try:
         # Generate unique request ID
-        request_id = str(uuid.uuid4())
+        request_id = _request_id()
         
         # Call Salesforce API
         url = f"{scrt_url}/api/v1/conversationHistory"
         headers = {
-            "Content-Type": "application/json",
+            **_SEND_HISTORY_HEADERS,
             "Authorization": f"Bearer {access_token}",
             "OrgId": org_id,
-            "AuthorizationContext": "Infobip_Chatbot",
-            "AuthorizationContextType": "EmbeddedMessagingChannel",
             "RequestId": request_id
         }
         
-        print(f"Calling Salesforce API: {url}")
-        print(f"Headers: {headers}")
-        print(f"Payload: {json.dumps(payload, indent=2)}")
+        log.info("Calling Salesforce API: %s", url)
+        log.debug("Headers: %s", headers)
+        log.debug("Payload: %s", _LazyJSON(payload))
         
-        response = requests.post(url, json=payload, headers=headers)
+        response = post_json(url, payload, headers)
         
-        print(f"Response Status: {response.status_code}")
-        print(f"Response Body: {response.text}")
+        log_response(response)
+        
+        # A rejected token must not be served from the cache again
+        if response.status_code == 401:
+            invalidate_oauth_token(access_token)
         
         if response.status_code in [200, 201]:
-            response_data = response.json()
+            response_data = orjson.loads(response.content)
             return True, {
                 "success": True,
                 "messagingSessionId": response_data.get("messagingSessionId"),
@@ -336,7 +423,7 @@ def handle_send_conversation_history(request_obj, app_state, scrt_url, org_id, e
     
     Args:
         request_obj: Flask request object
-        app_state: Application state dict
+        app_state: Session state of the current browser (app.SessionState)
         scrt_url: Salesforce SCRT URL
         org_id: Organization ID
         es_developer_name: ES Developer Name
@@ -349,17 +436,17 @@ def handle_send_conversation_history(request_obj, app_state, scrt_url, org_id, e
     
     # Fallback to app_state token if no OAuth token provided (backward compatibility)
     if not oauth_token:
-        if not app_state.get("access_token"):
+        if not app_state.access_token:
             return {
                 "success": False,
                 "error": "No access token available. Please generate access token first."
             }, 400
-        access_token = app_state["access_token"]
+        access_token = app_state.access_token
     else:
         access_token = oauth_token
     
     # For conversation ID, we can make it optional when using OAuth
-    conversation_id = app_state.get("conversation_id")
+    conversation_id = app_state.conversation_id
     if not conversation_id and not oauth_token:
         return {
             "success": False,
@@ -383,24 +470,24 @@ def handle_send_conversation_history(request_obj, app_state, scrt_url, org_id, e
         }, 400
     
     # Get or generate channel address
-    channel_address = app_state.get("channel_address_identifier")
+    channel_address = app_state.channel_address_identifier
     if not channel_address:
-        conversation_id = app_state.get("conversation_id")
+        conversation_id = app_state.conversation_id
         if conversation_id:
             channel_address = conversation_id.lower()
         else:
             # Generate a random channel address for OAuth flow
             channel_address = f"{uuid.uuid4()}"
     
-    print(f"📍 Using channelAddressIdentifier: {channel_address}")
-    print(f"   - From app_state['channel_address_identifier']: {app_state.get('channel_address_identifier')}")
-    print(f"   - From app_state['conversation_id']: {app_state.get('conversation_id')}")
+    log.info("📍 Using channelAddressIdentifier: %s", channel_address)
+    log.debug("   - From app_state.channel_address_identifier: %s", app_state.channel_address_identifier)
+    log.debug("   - From app_state.conversation_id: %s", app_state.conversation_id)
     
     
     # STEP 1: Establish conversation first
-    print("=" * 60)
-    print("STEP 1: Establishing conversation...")
-    print("=" * 60)
+    # The steps below must stay sequential: conversationHistory needs the established
+    # conversation, and the payload timestamps are taken after it exists
+    log.info("STEP 1: Establishing conversation...")
     
     success_establish, conversation_identifier, messaging_session_id, error = establish_conversation(
         access_token, channel_address, participants_data, org_id, es_developer_name, scrt_url
@@ -412,17 +499,16 @@ def handle_send_conversation_history(request_obj, app_state, scrt_url, org_id, e
             "error": f"Failed to establish conversation: {error}"
         }, 400
     
-    print(f"✓ Conversation established successfully!")
-    print(f"  - conversationIdentifier: {conversation_identifier}")
-    print(f"  - messagingSessionId: {messaging_session_id}")
+    log.info("✓ Conversation established successfully!")
+    log.info("  - conversationIdentifier: %s", conversation_identifier)
+    log.info("  - messagingSessionId: %s", messaging_session_id)
     
     # STEP 2: Transform data to Salesforce format
-    print("=" * 60)
-    print("STEP 2: Transforming conversation data...")
-    print("=" * 60)
+    log.info("STEP 2: Transforming conversation data...")
     
+    # Reuse the channel address from STEP 1 so the history lands in the established conversation
     payload, error = transform_conversation_to_salesforce_format(
-        data, scrt_url, org_id, es_developer_name, app_state
+        data, scrt_url, org_id, es_developer_name, app_state, channel_address=channel_address
     )
     
     if error:
@@ -432,9 +518,7 @@ def handle_send_conversation_history(request_obj, app_state, scrt_url, org_id, e
         }, 400
     
     # STEP 3: Send conversation history to Salesforce
-    print("=" * 60)
-    print("STEP 3: Sending conversation history...")
-    print("=" * 60)
+    log.info("STEP 3: Sending conversation history...")
     
     success, response_data, status_code = send_history_to_salesforce(
         payload, access_token, scrt_url, org_id, es_developer_name
@@ -524,13 +608,16 @@ def send_history_via_standard_api(access_token, instance_url, messaging_session_
             "Bot_Transcript__c": transcript_text
         }
 
-        print(f"Calling Salesforce Standard API (PATCH): {url}")
-        print(f"Payload length: {len(transcript_text)} chars")
+        log.info("Calling Salesforce Standard API (PATCH): %s", url)
+        log.debug("Payload length: %s chars", len(transcript_text))
+
+        response = SF_SESSION.patch(url, json=payload, headers=headers)
 
-        response = requests.patch(url, json=payload, headers=headers)
+        log_response(response, "Standard API Response")
 
-        print(f"Standard API Response Status: {response.status_code}")
-        print(f"Standard API Response Body: {response.text}")
+        # A rejected token must not be served from the cache again
+        if response.status_code == 401:
+            invalidate_oauth_token(access_token)
 
         # PATCH on SObject returns 204 No Content on success
         if response.status_code == 204:
@@ -0,0 +1,86 @@
+"""
+HTTP Client Module
+
+This module provides the shared requests session used for every outgoing
+Salesforce call (app routes, authentication and conversation history).
+"""
+
+import http.cookiejar
+import logging
+
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+log = logging.getLogger(__name__)
+
+# (connect, read) timeout in seconds for Salesforce calls, so a stalled
+# request cannot hold a server worker indefinitely
+SF_TIMEOUT = (5, 10)
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that applies a default timeout to every request"""
+
+    def __init__(self, *args, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+# Shared HTTP session so Salesforce calls reuse pooled keep-alive connections
+# instead of paying a new TCP + TLS handshake per request.
+# Concurrent calls (e.g. a typing indicator and a message sent back-to-back) each
+# take their own pooled connection, up to pool_maxsize per host, so they are not
+# serialized behind one another the way requests on a single HTTP/1.1 connection are.
+SF_SESSION = requests.Session()
+_adapter = TimeoutHTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    # raise_on_status=False: once retries run out, the last 5xx response is returned
+    # so handlers can report the upstream status and body as usual
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504], raise_on_status=False),
+    timeout=SF_TIMEOUT
+)
+SF_SESSION.mount("http://", _adapter)
+SF_SESSION.mount("https://", _adapter)
+
+# The session is shared by every browser, so it must not keep cookies: a Set-Cookie
+# from Salesforce would otherwise be sent on later calls made for other users
+SF_SESSION.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+
+# No default headers are set: Authorization belongs to a browser session and SF_SESSION
+# is shared by all of them, so callers pass it per request. Content-Type is only added
+# where there is a body (post_json below, or by requests itself for json=/form data).
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def log_response(response, label="Response"):
+    """Log a Salesforce response; the body is only decoded when DEBUG logging is enabled"""
+    log.info("%s Status: %s", label, response.status_code)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("%s Body: %s", label, response.text)
+
+
+def post_json(url, payload, headers=None):
+    """
+    POST a JSON payload on the shared session, encoded with orjson
+    
+    Args:
+        url: Request URL
+        payload: JSON-serializable payload
+        headers: Extra request headers (Content-Type: application/json is added)
+        
+    Returns:
+        requests.Response: Salesforce response
+    """
+    # Sent as one Content-Length body on purpose: orjson has no incremental encoder, so
+    # chunked transfer could not overlap encoding with sending, and some gateways reject
+    # chunked request bodies with 411 Length Required.
+    headers = {**_JSON_HEADERS, **headers} if headers else _JSON_HEADERS
+    return SF_SESSION.post(url, data=orjson.dumps(payload), headers=headers)
@@ -0,0 +1,25 @@
+"""
+Server Module
+
+This module runs the simulator under gevent's WSGI server. Sockets are
+monkey-patched before the app (and therefore requests) is imported, so a
+handler blocked on a Salesforce API call yields to other clients instead
+of stalling the whole process.
+"""
+
+from gevent import monkey
+
+# Must run before anything imports socket/ssl (requests, urllib3)
+monkey.patch_all()
+
+import os
+from gevent.pywsgi import WSGIServer
+
+from app import app, print_startup_banner
+
+
+if __name__ == '__main__':
+    port = int(os.getenv("PORT", "5001"))
+    print_startup_banner(port, server_label="gevent")
+    
+    WSGIServer(('0.0.0.0', port), app).serve_forever()
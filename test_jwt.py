@@ -8,8 +8,9 @@ sys.path.insert(0, '.')
 from auth import generate_jwt
 from dotenv import load_dotenv
 import os
-import jwt
+import base64
 import json
+import orjson
 
 load_dotenv()
 
@@ -27,8 +28,9 @@ try:
     print(f"\n✅ JWT Generated successfully!")
     print(f"Token (first 100 chars): {token[:100]}...")
     
-    # Decode without verification to inspect payload
-    decoded = jwt.decode(token, options={"verify_signature": False})
+    # Decode without verification to inspect payload (base64url segment, padding restored)
+    _, payload_b64, _ = token.split(".")
+    decoded = orjson.loads(base64.urlsafe_b64decode(payload_b64 + "=" * (-len(payload_b64) % 4)))
     print(f"\n📋 JWT Payload:")
     print(json.dumps(decoded, indent=2))
     